@@ -0,0 +1,20 @@
+import atexit
+import threading
+
+# Staged attendance swipes, shared by every session in the server process. Kept in a plain module
+# rather than st.cache_resource: until flushed they exist nowhere else, and Streamlit's "Clear cache"
+# would silently drop them.
+# rows: (ID, Date) -> {"entry": row to insert or None, "exit": exit time or None, "staged_at": time}
+attendance = {"rows": {}, "lock": threading.Lock(), "last_flush": 0.0}
+
+# gym.py is re-executed on every rerun, so it (re)points this at its flush function instead of
+# registering a new atexit handler each time.
+flush_hook = None
+
+
+def _flush_on_exit():
+    if flush_hook is not None:
+        flush_hook()
+
+
+atexit.register(_flush_on_exit)
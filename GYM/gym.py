@@ -1,69 +1,458 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
 from datetime import datetime
 from deepface import DeepFace
 from PIL import Image
+from kernels import cosine_scan
+import buffers
 import smtplib
+import time
 import json
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 
+try:
+    import faiss  # optional: approximate face search for very large member counts
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
 # -----------------------------
 # Setup and config load
 # -----------------------------
-os.makedirs("member_images", exist_ok=True)
-
-for f in ["members.csv", "attendance.csv", "deleted_members.csv"]:
-    if not os.path.exists(f):
-        pd.DataFrame().to_csv(f, index=False)
-
-with open("config.json", "r") as f:
-    config = json.load(f)
+CSV_FILES = ["deleted_members.csv"]
+MEMBERS_FILE = "members.parquet"
+MEMBER_COLS = ["ID","Name","Email","Mobile","Membership","Fee","ImagePath"]
+
+@st.cache_resource(show_spinner=False)
+def _init_fs():
+    # Runs once per server process rather than on every rerun
+    os.makedirs("member_images", exist_ok=True)
+    for f in CSV_FILES:
+        Path(f).touch(exist_ok=True)
+    if not os.path.exists(MEMBERS_FILE):
+        # Carry over members from the old members.csv store
+        try:
+            members = pd.read_csv("members.csv", dtype={"Mobile": str})
+        except:
+            members = pd.DataFrame(columns=MEMBER_COLS)
+        members.to_parquet(MEMBERS_FILE, index=False)
+    with open("config.json", "r") as cfg:
+        return json.load(cfg)
+
+config = _init_fs()
 
 GYM_EMAIL = config["gym_email"]
 APP_PASS = config["app_password"]
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+EMAIL_DEDUPE_SECONDS = 600  # an identical email to the same address within this window is not re-sent
+
+EMB_FILE = "embeddings_matrix.npy"
+FAISS_FILE = "members.faiss"
+ANN_MIN_MEMBERS = 10_000  # below this the exact matmul scan is faster than an index
+FACE_MODEL = "ArcFace"
+ATT_DB = "attendance.db"
+ATT_COLS = ["ID","Name","Date","EntryTime","ExitTime","Status"]
+FACE_THRESHOLD = 0.68  # DeepFace's cosine distance threshold for ArcFace
+STRONG_MATCH = 0.20    # distance at which a match is accepted without scanning further
+MATCH_CHUNK = 256      # embeddings scored per matmul
+KIOSK_BATCH = 4        # queued captures that trigger a batch match in kiosk mode
+FLUSH_SIZE = 20        # staged attendance rows that force a write
+FLUSH_SECONDS = 5      # staged attendance rows are written once they (or the last write) are this old
 
 # -----------------------------
 # Helper functions
 # -----------------------------
+@st.cache_resource
+def get_smtp():
+    # One TLS + LOGIN handshake shared by every email sent from this process
+    smtp = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+    smtp.login(GYM_EMAIL, APP_PASS)
+    return smtp
+
+@st.cache_resource
+def get_mail_pool():
+    # Single worker: the shared SMTP session must not be used from two threads at once
+    return ThreadPoolExecutor(max_workers=1)
+
+@st.cache_resource
+def _sent_emails():
+    # (address, subject, body) -> last send time; only touched from the single mail worker
+    return {}
+
 def send_email(to, subject, body):
+    # A malformed address would only fail after a full SMTP round-trip
+    to = str(to).strip()
+    if not EMAIL_RE.match(to):
+        logger.warning("Email not sent: invalid address %r", to)
+        return False
+    sent = _sent_emails()
+    now = time.time()
+    for key in [k for k, t in sent.items() if now - t >= EMAIL_DEDUPE_SECONDS]:
+        del sent[key]
+    key = (to.lower(), subject, body)
+    if key in sent:
+        # e.g. the same Update pressed twice
+        logger.info("Email not sent: duplicate of a recent message to %s", to)
+        return False
     try:
         msg = MIMEText(body)
         msg["Subject"] = subject
         msg["From"] = GYM_EMAIL
         msg["To"] = to
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(GYM_EMAIL, APP_PASS)
-            smtp.send_message(msg)
+        smtp = get_smtp()
+        try:
+            smtp.noop()
+        except (smtplib.SMTPException, OSError):
+            # Server dropped the idle session; reconnect
+            get_smtp.clear()
+            smtp = get_smtp()
+        smtp.send_message(msg)
+        sent[key] = now
         return True
-    except Exception as e:
-        st.error(f"Email Error: {e}")
+    except Exception:
+        # Runs on the mail pool thread, outside the Streamlit script context
+        logger.exception("Email Error: sending %r to %s failed", subject, to)
         return False
 
-def load_members():
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+# Parsed tables are cached per file mtime, so any write to the file invalidates them
+@st.cache_data(max_entries=1)
+def _load_members(mtime):
     try:
-        return pd.read_csv("members.csv")
+        return pd.read_parquet(MEMBERS_FILE)
     except:
-        return pd.DataFrame(columns=["ID","Name","Email","Mobile","Membership","Fee","ImagePath"])
+        return pd.DataFrame(columns=MEMBER_COLS)
+
+def load_members():
+    return _load_members(file_mtime(MEMBERS_FILE))
+
+@st.cache_data(max_entries=1)
+def _members_csv(mtime):
+    # CSV export is only rebuilt when the members table changes
+    return load_members().to_csv(index=False).encode()
+
+@st.cache_data(max_entries=1)
+def _member_index(mtime):
+    ids = load_members()["ID"].to_numpy()
+    order = np.argsort(ids, kind="stable")
+    return ids[order], order
+
+def member_position(member_id):
+    # Binary search over the sorted IDs (rebuilt only when the members table changes) instead of a column scan
+    ids_sorted, order = _member_index(file_mtime(MEMBERS_FILE))
+    return int(order[np.searchsorted(ids_sorted, member_id)])
 
 def save_members(df):
-    df.to_csv("members.csv", index=False)
+    # Mobile arrives as text from the forms; keep the column a single type for Parquet
+    df.astype({"Mobile": str}).to_parquet(MEMBERS_FILE, index=False)
+
+def has_header(path):
+    # Placeholder files from setup hold only '""' or a blank line
+    try:
+        with open(path) as f:
+            return f.readline().strip() not in ("", '""')
+    except OSError:
+        return False
+
+def append_csv(df, path):
+    # O(1) append; the file is only (re)written with a header while it has none
+    if has_header(path):
+        df.to_csv(path, mode="a", header=False, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def connect_attendance():
+    # (ID, Date) primary key doubles as the lookup index for entry/exit
+    new_db = not os.path.exists(ATT_DB)
+    conn = sqlite3.connect(ATT_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS attendance("
+                 "ID TEXT, Name TEXT, Date TEXT, EntryTime TEXT, ExitTime TEXT, Status TEXT, "
+                 "PRIMARY KEY(ID, Date))")
+    if new_db:
+        # Carry over records from the old attendance.csv store
+        try:
+            old = pd.read_csv("attendance.csv", dtype=str, keep_default_na=False)
+            conn.executemany("INSERT OR IGNORE INTO attendance VALUES(?,?,?,?,?,?)", old[ATT_COLS].values.tolist())
+        except:
+            pass
+        conn.commit()
+    return conn
+
+@st.cache_data(max_entries=1)
+def _load_attendance(mtime):
+    with closing(connect_attendance()) as conn:
+        return pd.read_sql("SELECT * FROM attendance", conn)
 
 def load_attendance():
+    return _load_attendance(file_mtime(ATT_DB))
+
+@st.cache_data(max_entries=1)
+def _attendance_csv(mtime):
+    return load_attendance().to_csv(index=False).encode()
+
+def attendance_buffer():
+    # Process-wide, so every session (entry and exit kiosks alike) sees staged swipes
+    return buffers.attendance
+
+def fetch_attendance(idstr, date):
+    with closing(connect_attendance()) as conn:
+        row = conn.execute("SELECT * FROM attendance WHERE ID=? AND Date=?", (idstr, date)).fetchone()
+    return dict(zip(ATT_COLS, row)) if row else None
+
+def mark_entry(row):
+    buf = attendance_buffer()
+    key = (row["ID"], row["Date"])
+    with buf["lock"]:
+        if key in buf["rows"] or fetch_attendance(*key):
+            return False
+        buf["rows"][key] = {"entry": row, "exit": None, "staged_at": time.time()}
+        return True
+
+def mark_exit(idstr, date, exit_time):
+    buf = attendance_buffer()
+    key = (idstr, date)
+    with buf["lock"]:
+        staged = buf["rows"].get(key)
+        if staged is None:
+            row = fetch_attendance(idstr, date)
+            if row is None or row["ExitTime"]:
+                return False
+            buf["rows"][key] = {"entry": None, "exit": exit_time, "staged_at": time.time()}
+        elif staged["exit"]:
+            return False
+        else:
+            staged["exit"] = exit_time
+        return True
+
+def _flush_locked(buf):
+    # One transaction; the same conflict rules as unbuffered writes, so the database still decides
+    # (a stale entry never overwrites an exit, an exit only closes an open entry)
+    rows = buf["rows"]
+    if not rows:
+        return
+    with closing(connect_attendance()) as conn, conn:
+        conn.executemany("INSERT OR IGNORE INTO attendance VALUES(?,?,?,?,?,?)",
+                         [[s["entry"][c] for c in ATT_COLS] for s in rows.values() if s["entry"]])
+        conn.executemany("UPDATE attendance SET ExitTime=?, Status='Exited' "
+                         "WHERE ID=? AND Date=? AND (ExitTime IS NULL OR ExitTime='')",
+                         [(s["exit"], *key) for key, s in rows.items() if s["exit"]])
+    rows.clear()
+    buf["last_flush"] = time.time()
+
+def flush_attendance():
+    buf = attendance_buffer()
+    with buf["lock"]:
+        _flush_locked(buf)
+
+buffers.flush_hook = flush_attendance  # written out on server shutdown
+
+def maybe_flush_attendance():
+    # Bursts of swipes are coalesced; a swipe after a quiet period is written straight away,
+    # and nothing stays staged longer than FLUSH_SECONDS once any session reruns
+    buf = attendance_buffer()
+    with buf["lock"]:
+        rows = buf["rows"]
+        if not rows:
+            return
+        now = time.time()
+        oldest = min(s["staged_at"] for s in rows.values())
+        if len(rows) >= FLUSH_SIZE or now - oldest >= FLUSH_SECONDS or now - buf["last_flush"] >= FLUSH_SECONDS:
+            _flush_locked(buf)
+
+@st.cache_resource
+def get_face_model():
+    # Built once per server process; DeepFace.represent reuses it from DeepFace's model cache.
+    # Runs on any GPU TensorFlow can see (select/hide cards with CUDA_VISIBLE_DEVICES); CPU otherwise.
+    import tensorflow as tf
+    for gpu in tf.config.list_physical_devices("GPU"):
+        try:
+            # Grow on demand instead of reserving the whole card; must happen before TF initializes it
+            tf.config.experimental.set_memory_growth(gpu, True)
+        except RuntimeError:
+            pass
+    return DeepFace.build_model(FACE_MODEL)
+
+def to_bgr(img):
+    # DeepFace takes arrays in OpenCV's BGR order, same as it decodes image files
+    return np.ascontiguousarray(np.array(img.convert("RGB"))[:, :, ::-1])
+
+def embed_face(img_path):
+    get_face_model()
+    rep = DeepFace.represent(img_path=img_path, model_name=FACE_MODEL, enforce_detection=False)[0]["embedding"]
+    v = np.asarray(rep, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+def save_embeddings(emb):
+    # Contiguous float32 (2 KB per 512-d ArcFace vector); no copy when it already is.
+    # Written beside the target and swapped in, so sessions that have the old file mapped keep its inode.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(EMB_FILE)), suffix=".npy")
     try:
-        return pd.read_csv("attendance.csv")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(emb, dtype=np.float32))
+        os.replace(tmp, EMB_FILE)
     except:
-        return pd.DataFrame(columns=["ID","Name","Date","EntryTime","ExitTime","Status"])
-
-def save_attendance(df):
-    df.to_csv("attendance.csv", index=False)
+        os.remove(tmp)
+        raise
 
-def try_verify_faces(img1, img2):
+def load_embeddings(members):
+    # One L2-normalized row per member, in members table order; memory-mapped so only touched pages are read
     try:
-        result = DeepFace.verify(img1_path=img1, img2_path=img2, enforce_detection=False)
-        return result["verified"], result.get("distance", 1.0), result
+        emb = np.load(EMB_FILE, mmap_mode="r")
     except:
-        return False, 1.0, None
+        emb = np.empty((0, 0), dtype=np.float32)
+    if (len(emb) != len(members) or emb.dtype != np.float32) and not members.empty:
+        # Out of sync (e.g. members registered before embeddings were stored): rebuild from photos
+        emb = np.vstack([embed_face(p) for p in members["ImagePath"].to_numpy()])
+        save_embeddings(emb)
+        update_ann_index(emb)
+    return emb
+
+def write_ann_index(index):
+    # Same swap-in as save_embeddings, so a concurrent read_index never sees a half-written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(FAISS_FILE)), suffix=".faiss")
+    os.close(fd)
+    try:
+        faiss.write_index(index, tmp)
+        os.replace(tmp, FAISS_FILE)
+    except:
+        os.remove(tmp)
+        raise
+
+def build_ann_index(emb):
+    # HNSW graph over inner product (= cosine on normalized rows), rows in members table order
+    index = faiss.IndexHNSWFlat(emb.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    index.add(np.ascontiguousarray(emb, dtype=np.float32))
+    write_ann_index(index)
+
+def update_ann_index(emb, appended=None):
+    # Called whenever the embeddings matrix is saved. Register passes the appended row and it is
+    # added to the existing graph; Delete (which shifts rows) and anything else rebuild it.
+    if faiss is None:
+        return
+    if len(emb) < ANN_MIN_MEMBERS:
+        if os.path.exists(FAISS_FILE):
+            os.remove(FAISS_FILE)
+        return
+    if appended is not None and os.path.exists(FAISS_FILE):
+        index = faiss.read_index(FAISS_FILE)
+        if index.ntotal == len(emb) - 1:
+            index.add(appended[None, :])
+            write_ann_index(index)
+            return
+    build_ann_index(emb)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_ann_index(faiss_mtime):
+    return faiss.read_index(FAISS_FILE)
+
+def ann_index(emb_matrix):
+    # Kept in step by Register/Delete; only built here if the file is missing or out of step
+    if os.path.exists(FAISS_FILE):
+        index = _load_ann_index(file_mtime(FAISS_FILE))
+        if index.ntotal == len(emb_matrix):
+            return index
+    build_ann_index(emb_matrix)
+    return _load_ann_index(file_mtime(FAISS_FILE))
+
+def scan_embeddings(emb_matrix, probe):
+    best, best_distance = -1, np.inf
+    for start in range(0, len(emb_matrix), MATCH_CHUNK):
+        distances = cosine_scan(np.asarray(emb_matrix[start:start + MATCH_CHUNK]), probe)
+        i = int(np.argmin(distances))
+        if distances[i] < best_distance:
+            best, best_distance = start + i, float(distances[i])
+        if best_distance < STRONG_MATCH:
+            break
+    return best, best_distance
+
+def search_ann(emb_matrix, probes):
+    sims, rows = ann_index(emb_matrix).search(probes, 1)
+    return rows[:, 0], 1.0 - sims[:, 0]
+
+def match_face(img, members):
+    emb_matrix = load_embeddings(members)
+    probe = embed_face(img)
+    if faiss is not None and len(emb_matrix) >= ANN_MIN_MEMBERS:
+        best, best_distance = search_ann(emb_matrix, probe[None, :])
+        best, best_distance = int(best[0]), float(best_distance[0])
+    else:
+        best, best_distance = scan_embeddings(emb_matrix, probe)
+    if best >= 0 and best_distance <= FACE_THRESHOLD:
+        return members.iloc[best]
+    return None
+
+def match_faces(imgs, members):
+    # Kiosk batches: one (N x D) @ (D x B) product scores every queued capture at once
+    emb_matrix = load_embeddings(members)
+    probes = np.vstack([embed_face(img) for img in imgs])
+    if faiss is not None and len(emb_matrix) >= ANN_MIN_MEMBERS:
+        best, best_distance = search_ann(emb_matrix, probes)
+    else:
+        distances = 1.0 - emb_matrix @ probes.T
+        best = np.argmin(distances, axis=0)
+        best_distance = distances[best, np.arange(len(imgs))]
+    return [members.iloc[int(b)] if b >= 0 and d <= FACE_THRESHOLD else None
+            for b, d in zip(best, best_distance)]
+
+def record_entry(matched_row, captured_at):
+    # captured_at is when the photo was taken, which in kiosk mode can be well before it is matched
+    if matched_row is None:
+        st.error("No matching member found.")
+        return
+    new_entry = {
+        "ID": str(matched_row["ID"]),
+        "Name": matched_row["Name"],
+        "Date": captured_at.strftime("%Y-%m-%d"),
+        "EntryTime": captured_at.strftime("%H:%M:%S"),
+        "ExitTime": "",
+        "Status": "Present"
+    }
+    if mark_entry(new_entry):
+        st.success(f"Entry marked for {matched_row['Name']}")
+    else:
+        st.warning(f"Entry already marked today for {matched_row['Name']}.")
+
+def record_exit(matched_row, captured_at):
+    if matched_row is None:
+        st.error("No matching member found.")
+        return
+    if mark_exit(str(matched_row["ID"]), captured_at.strftime("%Y-%m-%d"), captured_at.strftime("%H:%M:%S")):
+        st.success(f"Exit marked for {matched_row['Name']}")
+    else:
+        st.warning(f"No open entry found for {matched_row['Name']} today.")
+
+def process_kiosk_queue(name, photo, record):
+    # (capture time, frame) pairs are queued in the session and matched together once KIOSK_BATCH are waiting
+    queue = st.session_state.setdefault(f"{name}_queue", [])
+    if photo and st.session_state.get(f"{name}_last") != photo.file_id:
+        # camera_input keeps returning the last capture on reruns; queue each one only once
+        st.session_state[f"{name}_last"] = photo.file_id
+        queue.append((datetime.now(), to_bgr(Image.open(photo))))
+    st.caption(f"{len(queue)} capture(s) queued")
+    if queue and (len(queue) >= KIOSK_BATCH or st.button("Process queued captures")):
+        members = load_members()
+        if members.empty:
+            st.warning("No members registered.")
+            return
+        with st.spinner("Matching faces..."):
+            matches = match_faces([img for _, img in queue], members)
+        captured = [captured_at for captured_at, _ in queue]
+        queue.clear()
+        for matched_row, captured_at in zip(matches, captured):
+            record(matched_row, captured_at)
 
 # -----------------------------
 # UI Layout
@@ -80,6 +469,11 @@ menu = st.sidebar.radio("Navigation", [
     "View Attendance",
     "Reset DB"
 ])
+kiosk = st.sidebar.checkbox("Kiosk mode (batch captures)")
+if st.sidebar.button("💾 Save pending attendance"):
+    flush_attendance()
+else:
+    maybe_flush_attendance()
 
 # -----------------------------
 # Register Member
@@ -97,6 +491,8 @@ if menu == "Register Member":
     if st.button("Register Member"):
         if not all([name, email, mobile, membership, photo]):
             st.warning("Please fill all fields and capture image.")
+        elif not EMAIL_RE.match(email.strip()):
+            st.warning("Please enter a valid email address.")
         else:
             members = load_members()
             new_id = len(members) + 1 if not members.empty else 1
@@ -104,6 +500,12 @@ if menu == "Register Member":
             img = Image.open(photo)
             img.save(img_path)
 
+            new_emb = embed_face(to_bgr(img))
+            emb = load_embeddings(members)
+            emb = np.vstack([emb, new_emb]) if len(emb) else new_emb[None, :]
+            save_embeddings(emb)
+            update_ann_index(emb, new_emb)
+
             new_data = pd.DataFrame([{
                 "ID": new_id,
                 "Name": name,
@@ -113,11 +515,10 @@ if menu == "Register Member":
                 "Fee": fee,
                 "ImagePath": img_path
             }])
-            members = pd.concat([members, new_data], ignore_index=True)
-            save_members(members)
+            save_members(pd.concat([members, new_data], ignore_index=True))
 
-            send_email(email, "Gym Registration Successful",
-                       f"Dear {name},\n\nWelcome to our Gym!\nYour Member ID: {new_id}\nMembership: {membership}\nFee: ₹{fee}\n\nStay Fit!\n- Gym Team")
+            get_mail_pool().submit(send_email, email, "Gym Registration Successful",
+                                   f"Dear {name},\n\nWelcome to our Gym!\nYour Member ID: {new_id}\nMembership: {membership}\nFee: ₹{fee}\n\nStay Fit!\n- Gym Team")
 
             st.success(f"Member Registered! ID: {new_id}")
             st.image(img_path, caption="Saved Photo", width=200)
@@ -134,7 +535,8 @@ elif menu == "Update / Delete Member":
     else:
         ids = members["ID"].astype(str)
         selected_id = st.selectbox("Select Member ID", ids)
-        member = members[members["ID"].astype(str) == selected_id].iloc[0]
+        pos = member_position(int(selected_id))
+        member = members.iloc[pos]
 
         name = st.text_input("Full Name", member["Name"])
         email = st.text_input("Email", member["Email"])
@@ -143,22 +545,26 @@ elif menu == "Update / Delete Member":
         fee = st.number_input("Fee (₹)", min_value=0, value=int(member["Fee"]))
 
         if st.button("Update Member"):
-            members.loc[members["ID"] == int(selected_id), ["Name","Email","Mobile","Membership","Fee"]] = [name,email,mobile,membership,fee]
-            save_members(members)
-            send_email(email, "Gym Details Updated", f"Dear {name}, your gym details have been updated successfully.\nMembership: {membership}\nFee: ₹{fee}")
-            st.success("Member updated successfully.")
+            if not EMAIL_RE.match(email.strip()):
+                st.warning("Please enter a valid email address.")
+            else:
+                members.loc[members.index[pos], ["Name","Email","Mobile","Membership","Fee"]] = [name,email,mobile,membership,fee]
+                save_members(members)
+                get_mail_pool().submit(send_email, email, "Gym Details Updated", f"Dear {name}, your gym details have been updated successfully.\nMembership: {membership}\nFee: ₹{fee}")
+                st.success("Member updated successfully.")
 
         if st.button("Delete Member"):
-            del_member = members[members["ID"] == int(selected_id)]
-            members = members[members["ID"] != int(selected_id)]
+            del_member = members.iloc[[pos]]
+            emb = np.delete(load_embeddings(members), pos, axis=0)
+            save_embeddings(emb)
+            update_ann_index(emb)
+            members = members.drop(members.index[pos])
             save_members(members)
 
-            deleted = pd.DataFrame(del_member)
-            if not deleted.empty:
-                pd.concat([pd.read_csv("deleted_members.csv", on_bad_lines='skip'), deleted], ignore_index=True).to_csv("deleted_members.csv", index=False)
+            append_csv(del_member, "deleted_members.csv")
 
-            send_email(member["Email"], "Gym Membership Deleted",
-                       f"Dear {member['Name']}, your gym membership (ID: {selected_id}) has been deleted from our records.")
+            get_mail_pool().submit(send_email, member["Email"], "Gym Membership Deleted",
+                                   f"Dear {member['Name']}, your gym membership (ID: {selected_id}) has been deleted from our records.")
             st.success("Member deleted successfully.")
 
 # -----------------------------
@@ -168,47 +574,19 @@ elif menu == "Attendance – Entry":
     st.header("📥 Mark Entry")
     photo = st.camera_input("📷 Capture Face for Entry")
 
-    if photo:
-        img_path = "temp_entry.jpg"
-        img = Image.open(photo)
-        img.save(img_path)
+    if kiosk:
+        process_kiosk_queue("entry", photo, record_entry)
+    elif photo:
+        captured_at = datetime.now()
+        img = to_bgr(Image.open(photo))
         members = load_members()
 
         if members.empty:
             st.warning("No members registered.")
         else:
-            matched_row, best_distance = None, 1.0
-            progress = st.progress(0)
-            for i, (_, row) in enumerate(members.iterrows(), 1):
-                progress.progress(int(i / len(members) * 100))
-                match, dist, _ = try_verify_faces(img_path, row["ImagePath"])
-                if match and dist < best_distance:
-                    matched_row, best_distance = row, dist
-            progress.empty()
-
-            if matched_row is not None:
-                attendance = load_attendance()
-                now = datetime.now()
-                today = now.strftime("%Y-%m-%d")
-                idstr = str(matched_row["ID"])
-
-                exists = attendance[(attendance["ID"].astype(str) == idstr) & (attendance["Date"] == today)]
-                if not exists.empty:
-                    st.warning("Entry already marked today.")
-                else:
-                    new_entry = {
-                        "ID": idstr,
-                        "Name": matched_row["Name"],
-                        "Date": today,
-                        "EntryTime": now.strftime("%H:%M:%S"),
-                        "ExitTime": "",
-                        "Status": "Present"
-                    }
-                    attendance = pd.concat([attendance, pd.DataFrame([new_entry])], ignore_index=True)
-                    save_attendance(attendance)
-                    st.success(f"Entry marked for {matched_row['Name']}")
-            else:
-                st.error("No matching member found.")
+            with st.spinner("Matching face..."):
+                matched_row = match_face(img, members)
+            record_entry(matched_row, captured_at)
 
 # -----------------------------
 # Attendance – Exit
@@ -217,43 +595,19 @@ elif menu == "Attendance – Exit":
     st.header("📤 Mark Exit")
     photo = st.camera_input("📷 Capture Face for Exit")
 
-    if photo:
-        img_path = "temp_exit.jpg"
-        img = Image.open(photo)
-        img.save(img_path)
+    if kiosk:
+        process_kiosk_queue("exit", photo, record_exit)
+    elif photo:
+        captured_at = datetime.now()
+        img = to_bgr(Image.open(photo))
         members = load_members()
 
         if members.empty:
             st.warning("No members registered.")
         else:
-            matched_row, best_distance = None, 1.0
-            progress = st.progress(0)
-            for i, (_, row) in enumerate(members.iterrows(), 1):
-                progress.progress(int(i / len(members) * 100))
-                match, dist, _ = try_verify_faces(img_path, row["ImagePath"])
-                if match and dist < best_distance:
-                    matched_row, best_distance = row, dist
-            progress.empty()
-
-            if matched_row is not None:
-                attendance = load_attendance()
-                now = datetime.now()
-                today = now.strftime("%Y-%m-%d")
-                idstr = str(matched_row["ID"])
-
-                mask = (attendance["ID"].astype(str) == idstr) & (attendance["Date"] == today)
-                open_rows = attendance[mask & ((attendance["ExitTime"].isna()) | (attendance["ExitTime"] == ""))]
-
-                if open_rows.empty:
-                    st.warning("No open entry found for today.")
-                else:
-                    idx = open_rows.index[0]
-                    attendance.at[idx, "ExitTime"] = now.strftime("%H:%M:%S")
-                    attendance.at[idx, "Status"] = "Exited"
-                    save_attendance(attendance)
-                    st.success(f"Exit marked for {matched_row['Name']}")
-            else:
-                st.error("No matching member found.")
+            with st.spinner("Matching face..."):
+                matched_row = match_face(img, members)
+            record_exit(matched_row, captured_at)
 
 # -----------------------------
 # View Members
@@ -265,19 +619,20 @@ elif menu == "View Members":
         st.info("No members found.")
     else:
         st.dataframe(df)
-        st.download_button("📄 Download Members CSV", df.to_csv(index=False), "members.csv")
+        st.download_button("📄 Download Members CSV", _members_csv(file_mtime(MEMBERS_FILE)), "members.csv")
 
 # -----------------------------
 # View Attendance
 # -----------------------------
 elif menu == "View Attendance":
     st.header("📋 View Attendance")
+    flush_attendance()
     df = load_attendance()
     if df.empty:
         st.info("No attendance records.")
     else:
         st.dataframe(df)
-        st.download_button("📄 Download Attendance CSV", df.to_csv(index=False), "attendance.csv")
+        st.download_button("📄 Download Attendance CSV", _attendance_csv(file_mtime(ATT_DB)), "attendance.csv")
 
 # -----------------------------
 # Reset DB
@@ -285,8 +640,22 @@ elif menu == "View Attendance":
 elif menu == "Reset DB":
     st.header("⚠️ Reset Database")
     if st.button("Delete All Data (Danger)"):
-        for f in ["members.csv", "attendance.csv", "deleted_members.csv"]:
-            pd.DataFrame().to_csv(f, index=False)
-        for img in os.listdir("member_images"):
-            os.remove(os.path.join("member_images", img))
+        for f in CSV_FILES:
+            open(f, "w").close()
+        save_members(pd.DataFrame(columns=MEMBER_COLS))
+        buf = attendance_buffer()
+        with buf["lock"], closing(connect_attendance()) as conn, conn:
+            # Staged swipes from every session go too, so none are written back after the wipe
+            buf["rows"].clear()
+            conn.execute("DELETE FROM attendance")
+        shutil.rmtree("member_images", ignore_errors=True)
+        os.makedirs("member_images", exist_ok=True)
+        for f in [EMB_FILE, FAISS_FILE]:
+            if os.path.exists(f):
+                os.remove(f)
         st.success("All data reset successfully!")
+
+# -----------------------------
+# Write buffered attendance
+# -----------------------------
+maybe_flush_attendance()
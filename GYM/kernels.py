@@ -0,0 +1,29 @@
+import threading
+
+import numpy as np
+from numba import njit, prange
+
+# Streamlit runs every session on its own thread, but Numba's fallback "workqueue" threading layer
+# (used when neither TBB nor libgomp is available) aborts the process on concurrent parallel launches.
+# Kernel calls are serialized; each call still uses every core through prange.
+_scan_lock = threading.Lock()
+
+
+# Lives outside gym.py: Streamlit re-executes the app script on every rerun, but this module is
+# imported once, and cache=True keeps the compiled kernel on disk across server restarts.
+@njit(parallel=True, fastmath=True, cache=True)
+def _cosine_scan(mat, probe):
+    # mat: (N, D) float32 L2-normalized rows, probe: (D,) float32 normalized -> (N,) cosine distances
+    n = mat.shape[0]
+    out = np.empty(n, np.float32)
+    for i in prange(n):
+        s = np.float32(0.0)
+        for j in range(mat.shape[1]):
+            s += mat[i, j] * probe[j]
+        out[i] = 1.0 - s
+    return out
+
+
+def cosine_scan(mat, probe):
+    with _scan_lock:
+        return _cosine_scan(mat, probe)